@@ -0,0 +1,234 @@
+"""
+Benchmark de concorrência: quantos usuários simultâneos um processo atende
+ANTES (handler síncrono rodando na thread pool do Gradio) e DEPOIS
+(handlers async + executor do BD + filas por concurrency_id).
+
+"Antes" reproduz aqui o handler original: requests.get, um prompt e um
+cliente GPT-4 novos a cada chamada (sem roteamento) e sqlite síncrono.
+"Depois" chama o adicionar_nota atual de main.py.
+
+Roda offline: o LLM é substituído pelo FakeChatBackend (latência fixa) e a
+NFC-e é servida por um servidor HTTP local.
+
+    python bench_concorrencia.py --usuarios 200 --latencia-llm 1.0
+
+Mede, com N usuários adicionando notas ao mesmo tempo:
+- pico de extrações em andamento (usuários atendidos simultaneamente);
+- tempo total e vazão (notas/s);
+- latência de 'Listar Notas' disparado durante a carga (leituras rápidas
+  não devem esperar atrás das extrações lentas).
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from langchain.prompts import ChatPromptTemplate
+
+# Threads que o Gradio usa para handlers síncronos (limite padrão do anyio)
+GRADIO_THREADS = 40
+
+RESPOSTA_LLM = json.dumps({
+    "Dados Nota": {
+        "CNPJ": "12.345.678/0001-90", "Número": "1", "Série": "1",
+        "Emissão": "25/01/2025", "Horário": "10:00:00", "Valor Total": "15,50"
+    },
+    "Produtos": [
+        {"Id": "1", "Text": "Arroz", "Category": "Mercearia",
+         "Traits": {"Quantidade": "1", "Unidade": "UN", "Valor Unitário": "10.00", "Valor Total": "10.00"}},
+        {"Id": "2", "Text": "Feijão", "Category": "Mercearia",
+         "Traits": {"Quantidade": "1", "Unidade": "UN", "Valor Unitário": "5.50", "Valor Total": "5.50"}},
+    ]
+}, ensure_ascii=False)
+
+
+def iniciar_servidor_nfce(latencia):
+    """
+    Sobe um servidor HTTP local que devolve um HTML fixo após `latencia` segundos.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latencia)
+            corpo = b"<html><body>NFC-e de teste</body></html>"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass
+
+    class Servidor(ThreadingHTTPServer):
+        # O padrão (5) faz o kernel descartar conexões com muitos usuários
+        # simultâneos, e os clientes só tentam de novo após 1s, 2s, 4s...
+        request_queue_size = 1024
+
+    servidor = Servidor(("127.0.0.1", 0), Handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_port}/nfce"
+
+
+class Contador:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.atual = 0
+        self.pico = 0
+
+    def entrar(self):
+        with self._lock:
+            self.atual += 1
+            self.pico = max(self.pico, self.atual)
+
+    def sair(self):
+        with self._lock:
+            self.atual -= 1
+
+
+def resumo(nome, pico, total, usuarios, leituras):
+    return {
+        "cenario": nome,
+        "pico_simultaneos": pico,
+        "tempo_total": total,
+        "vazao": usuarios / total,
+        "leitura_p50": statistics.median(leituras),
+        "leitura_max": max(leituras),
+    }
+
+
+def bench_antes(main, backend, url, state, usuarios, leituras):
+    """
+    Handler síncrono original na thread pool do Gradio. `backend` faz o papel
+    do ChatOpenAI(model="gpt-4") que era criado a cada chamada.
+    """
+    contador = Contador()
+    template = main.EXTRACAO_PROMPT.messages[0].prompt.template
+
+    def adicionar_nota_sync():
+        contador.entrar()
+        try:
+            response = requests.get(url)
+            response.raise_for_status()
+            prompt = ChatPromptTemplate.from_template(template)
+            llm = backend(main.MODELO_FORTE)
+            resultado = llm.invoke(prompt.format_messages(html_content=response.text))
+            dados = main.filtrar_dados(resultado.content.strip())
+            main.get_user_db(state).salvar_dados(
+                dados["CNPJ"], dados["Emissao"], dados["Dados Nota"], dados["Produtos"]
+            )
+        finally:
+            contador.sair()
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=GRADIO_THREADS) as pool:
+        extracoes = [pool.submit(adicionar_nota_sync) for _ in range(usuarios)]
+        time.sleep(0.1)
+        # O tempo da leitura conta desde o clique (submit), não desde o início na thread
+        pedidos = []
+        for _ in range(leituras):
+            pedidos.append((time.perf_counter(), pool.submit(main.listar_notas, state)))
+            time.sleep(0.01)
+        latencias = []
+        for clique, futuro in pedidos:
+            futuro.result()
+            latencias.append(time.perf_counter() - clique)
+        for f in extracoes:
+            f.result()
+    total = time.perf_counter() - inicio
+    return resumo("antes (sync, thread pool)", contador.pico, total, usuarios, latencias)
+
+
+async def bench_depois(main, url, state, usuarios, leituras):
+    """
+    Handlers async; cada concurrency_id tem seu limite, como na fila do Gradio.
+    """
+    contador = Contador()
+    limites = {
+        nome: asyncio.Semaphore(limite)
+        for nome, limite in main.LIMITES_CONCORRENCIA.items()
+    }
+
+    async def adicionar():
+        async with limites["extracao"]:
+            contador.entrar()
+            try:
+                msg = await main.adicionar_nota(url, state)
+                if not msg.startswith("Nota adicionada"):
+                    raise Exception(msg)
+            finally:
+                contador.sair()
+
+    async def listar():
+        clique = time.perf_counter()
+        async with limites["leitura"]:
+            await main.run_db(main.listar_notas, state)
+        return time.perf_counter() - clique
+
+    inicio = time.perf_counter()
+    extracoes = [asyncio.create_task(adicionar()) for _ in range(usuarios)]
+    await asyncio.sleep(0.1)
+    tarefas_leitura = []
+    for _ in range(leituras):
+        tarefas_leitura.append(asyncio.create_task(listar()))
+        await asyncio.sleep(0.01)
+    latencias = await asyncio.gather(*tarefas_leitura)
+    await asyncio.gather(*extracoes)
+    total = time.perf_counter() - inicio
+    return resumo("depois (async)", contador.pico, total, usuarios, latencias)
+
+
+def main_bench(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--usuarios", type=int, default=200, help="Extrações simultâneas")
+    parser.add_argument("--leituras", type=int, default=20, help="Cliques em 'Listar Notas' durante a carga")
+    parser.add_argument("--latencia-llm", type=float, default=1.0, help="Segundos por resposta do LLM")
+    parser.add_argument("--latencia-http", type=float, default=0.05, help="Segundos por download da NFC-e")
+    parser.add_argument("--limite-extracao", type=int, help="Sobrescreve CONCORRENCIA_EXTRACAO")
+    args = parser.parse_args(argv)
+
+    if args.limite_extracao:
+        os.environ["CONCORRENCIA_EXTRACAO"] = str(args.limite_extracao)
+
+    # O app cria users.db e os BDs dos usuários no diretório atual
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(tempfile.mkdtemp(prefix="bench_"))
+    import main
+
+    modelos = [main.MODELO_RAPIDO, main.MODELO_FORTE]
+    backend = main.FakeChatBackend(
+        {m: RESPOSTA_LLM for m in modelos}, latencia=args.latencia_llm
+    )
+    main.model_router = main.ModelRouter(modelos, backend_factory=backend)
+    main.user_manager.register_user("bench", "bench", "paralelo2025")
+    state = {"logged_in": True, "username": "bench"}
+    servidor, url = iniciar_servidor_nfce(args.latencia_http)
+
+    try:
+        resultados = [
+            bench_antes(main, backend, url, state, args.usuarios, args.leituras),
+            asyncio.run(bench_depois(main, url, state, args.usuarios, args.leituras)),
+        ]
+    finally:
+        servidor.shutdown()
+
+    print(f"{args.usuarios} usuários adicionando notas (LLM {args.latencia_llm:.2f}s, "
+          f"HTTP {args.latencia_http:.2f}s), {args.leituras} leituras durante a carga\n")
+    print(f"{'cenário':<28}{'simultâneos':>12}{'total (s)':>11}{'notas/s':>9}"
+          f"{'listar p50 (s)':>16}{'listar máx (s)':>16}")
+    for r in resultados:
+        print(f"{r['cenario']:<28}{r['pico_simultaneos']:>12}{r['tempo_total']:>11.2f}"
+              f"{r['vazao']:>9.1f}{r['leitura_p50']:>16.3f}{r['leitura_max']:>16.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_bench())
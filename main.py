@@ -1,14 +1,23 @@
 import gradio as gr
 from datetime import datetime
 import sqlite3
-import requests
 import json
 import os
 import shutil  # Para remover arquivos
+import csv
+import sys
+import argparse
+import tempfile
+import threading
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
 
 from langchain.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
-from langchain.schema.runnable import RunnableMap
+from langchain.schema import AIMessage
 
 # =============================================================================
 # CONFIGURAÇÃO DA CHAVE OPENAI
@@ -16,6 +25,63 @@ from langchain.schema.runnable import RunnableMap
 os.environ['OPENAI_API_KEY'] = 's'
 
 
+# =============================================================================
+# CONFIGURAÇÃO DOS MODELOS (ROTEAMENTO EM CAMADAS)
+# =============================================================================
+# Ordem de tentativa: o modelo rápido é usado primeiro e o forte só entra
+# quando a resposta do rápido não passa na validação.
+MODELO_RAPIDO = os.getenv("MODELO_RAPIDO", "gpt-4o-mini")
+MODELO_FORTE = os.getenv("MODELO_FORTE", "gpt-4")
+
+# Diferença máxima (R$) aceita entre a soma dos itens e o total da nota
+TOLERANCIA_TOTAL_NOTA = 0.05
+
+
+# =============================================================================
+# CONFIGURAÇÃO DE CONCORRÊNCIA
+# =============================================================================
+# Os handlers são assíncronos: enquanto esperam HTTP ou o LLM não ocupam
+# thread. O acesso ao SQLite (bloqueante) roda em um executor próprio.
+DB_WORKERS = int(os.getenv("DB_WORKERS", "8"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+
+# Limite de eventos simultâneos por tipo (concurrency_id da fila do Gradio).
+# Cada tipo tem a sua fila, então extrações lentas não bloqueiam as leituras.
+LIMITES_CONCORRENCIA = {
+    "extracao": int(os.getenv("CONCORRENCIA_EXTRACAO", "64")),
+    "consultoria": int(os.getenv("CONCORRENCIA_CONSULTORIA", "16")),
+    "leitura": int(os.getenv("CONCORRENCIA_LEITURA", "32")),
+    "conta": int(os.getenv("CONCORRENCIA_CONTA", "16")),
+    "exportacao": int(os.getenv("CONCORRENCIA_EXPORTACAO", "2")),
+}
+
+
+# =============================================================================
+# CONFIGURAÇÃO DA EXPORTAÇÃO
+# =============================================================================
+# Quantidade de linhas lidas do BD por vez durante a exportação.
+# Mantém o uso de memória constante, independente do tamanho do BD.
+EXPORT_CHUNK_SIZE = 500
+# Linhas por row group no Parquet: os blocos lidos do BD são acumulados até
+# esse tamanho antes de gravar (um row group por bloco deixa o arquivo lento)
+PARQUET_ROW_GROUP_SIZE = 65536
+FORMATOS_EXPORTACAO = ("csv", "ndjson", "parquet")
+
+# Arquivos gerados pela aba Exportar (e as cópias do Gradio) são apagados
+# depois de EXPORT_TTL segundos, para não acumular dados dos usuários no disco.
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "eagle_exportacoes")
+EXPORT_TTL = int(os.getenv("EXPORT_TTL", "600"))
+
+COLUNAS_EXPORT_NOTAS = ["id", "cnpj", "emissao", "dados_nota"]
+COLUNAS_EXPORT_PRODUTOS = [
+    "id", "nota_id", "cnpj", "emissao", "produto_id", "nome", "categoria",
+    "quantidade", "unidade", "valor_unitario", "valor_total"
+]
+
+# Remove a pontuação do CNPJ no próprio SQLite (ex: 12.345.678/0001-90)
+SQL_CNPJ_DIGITOS = "REPLACE(REPLACE(REPLACE(REPLACE({col}, '.', ''), '/', ''), '-', ''), ' ', '')"
+
+
 # =============================================================================
 # CLASSE DE GERENCIAMENTO GLOBAL DE USUÁRIOS (users.db)
 # =============================================================================
@@ -288,62 +354,427 @@ class NotaFiscalDB:
             "total_valor": total_valor if total_valor else 0
         }
 
+    def listar_precos_produtos(self):
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT nome, cnpj_emissao, valor_unitario
+            FROM produtos
+            WHERE nome != ''
+              AND valor_unitario != ''
+            ORDER BY nome
+        """)
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+    # ----------------- EXPORTAÇÃO (LEITURA EM BLOCOS) -----------------
+    def _iter_blocos(self, sql, params, chunk_size):
+        """
+        Executa a consulta e devolve as linhas em blocos de `chunk_size`,
+        usando fetchmany para nunca carregar a tabela inteira em memória.
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    def iter_notas(self, cnpj=None, chunk_size=EXPORT_CHUNK_SIZE):
+        """
+        Percorre as notas em blocos. Colunas: COLUNAS_EXPORT_NOTAS.
+        `cnpj` deve conter apenas dígitos.
+        """
+        sql = "SELECT id, cnpj, emissao, dados_nota FROM notas"
+        params = ()
+        if cnpj:
+            sql += f" WHERE {SQL_CNPJ_DIGITOS.format(col='cnpj')} = ?"
+            params = (cnpj,)
+        sql += " ORDER BY id"
+        return self._iter_blocos(sql, params, chunk_size)
+
+    def iter_produtos(self, cnpj=None, chunk_size=EXPORT_CHUNK_SIZE):
+        """
+        Percorre os produtos em blocos, já associados à nota de origem.
+        Colunas: COLUNAS_EXPORT_PRODUTOS. `cnpj` deve conter apenas dígitos.
+        """
+        # Notas repetidas (mesmo CNPJ + emissão) apontam para os mesmos
+        # produtos; usa apenas a primeira para não duplicar linhas.
+        # A chave vira coluna da subconsulta para o SQLite criar um índice
+        # automático no join. O '+' tira a afinidade TEXT de cnpj_emissao;
+        # sem ele o índice não é usado e o plano vira SCAN x SCAN (quadrático).
+        sql = """
+            SELECT p.id, n.id, n.cnpj, n.emissao, p.produto_id, p.nome,
+                   p.categoria, p.quantidade, p.unidade, p.valor_unitario,
+                   p.valor_total
+            FROM produtos p
+            JOIN (
+                SELECT MIN(id) AS id, cnpj, emissao, cnpj || '_' || emissao AS chave
+                FROM notas
+                GROUP BY cnpj, emissao
+            ) n ON +p.cnpj_emissao = n.chave
+        """
+        params = ()
+        if cnpj:
+            sql += f" WHERE {SQL_CNPJ_DIGITOS.format(col='n.cnpj')} = ?"
+            params = (cnpj,)
+        sql += " ORDER BY p.id"
+        return self._iter_blocos(sql, params, chunk_size)
+
+
+# =============================================================================
+# ROTEAMENTO DE MODELOS (RÁPIDO -> FORTE)
+# =============================================================================
+class RespostaAproveitavel(Exception):
+    """
+    Falha de validação que não invalida a resposta: o roteador tenta o
+    próximo modelo, mas guarda esta resposta como reserva caso nenhum passe.
+    Qualquer outra exceção de validação descarta a resposta.
+    """
+
+
+class FakeChatBackend:
+    """
+    Backend local para testar o roteamento sem acessar a OpenAI.
+
+    `respostas` mapeia o nome do modelo para o texto devolvido, ou para uma
+    função (mensagens) -> texto. Uso:
+        ModelRouter([MODELO_RAPIDO, MODELO_FORTE], backend_factory=FakeChatBackend({...}))
+    """
+
+    def __init__(self, respostas, latencia=0.0):
+        self.respostas = respostas
+        self.latencia = latencia
+        self.chamadas = []
+
+    def __call__(self, modelo):
+        backend = self
+
+        class _Cliente:
+            def _responder(self, mensagens):
+                resposta = backend.respostas[modelo]
+                if callable(resposta):
+                    resposta = resposta(mensagens)
+                return AIMessage(content=resposta)
+
+            def invoke(self, mensagens):
+                backend.chamadas.append(modelo)
+                if backend.latencia:
+                    time.sleep(backend.latencia)
+                return self._responder(mensagens)
+
+            async def ainvoke(self, mensagens):
+                backend.chamadas.append(modelo)
+                if backend.latencia:
+                    await asyncio.sleep(backend.latencia)
+                return self._responder(mensagens)
+
+        return _Cliente()
+
+
+class ModelRouter:
+    """
+    Envia cada pedido primeiro ao modelo mais rápido da lista e só sobe para
+    o próximo quando a resposta falha na validação (ou o modelo dá erro).
+
+    Os clientes são criados uma única vez por modelo e reaproveitados entre
+    chamadas. Guarda, por tipo de chamada (ex: "extracao", "consultoria"),
+    estatísticas de latência por modelo e a taxa de escalonamento.
+    """
+
+    def __init__(self, modelos, backend_factory=None):
+        self.modelos = list(modelos)
+        if not self.modelos:
+            raise Exception("ModelRouter precisa de pelo menos um modelo.")
+        self.backend_factory = backend_factory or (lambda modelo: ChatOpenAI(model=modelo, temperature=0))
+        self._clientes = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _cliente(self, modelo):
+        with self._lock:
+            if modelo not in self._clientes:
+                self._clientes[modelo] = self.backend_factory(modelo)
+            return self._clientes[modelo]
+
+    def _stats_tipo(self, tipo):
+        # Chamar com self._lock adquirido
+        if tipo not in self._stats:
+            self._stats[tipo] = {"pedidos": 0, "escalonados": 0, "modelos": {}}
+        return self._stats[tipo]
+
+    def _registrar(self, tipo, modelo, latencia, reprovada=False, erro=False):
+        with self._lock:
+            st = self._stats_tipo(tipo)["modelos"].setdefault(modelo, {
+                "chamadas": 0, "reprovadas": 0, "erros": 0,
+                "latencia_total": 0.0, "latencia_max": 0.0
+            })
+            st["chamadas"] += 1
+            st["latencia_total"] += latencia
+            st["latencia_max"] = max(st["latencia_max"], latencia)
+            if reprovada:
+                st["reprovadas"] += 1
+            if erro:
+                st["erros"] += 1
+
+    def _escalonar(self, validar, tipo, modelos):
+        """
+        Laço de escalonamento compartilhado por invoke e ainvoke.
+
+        Gerador: entrega (yield) o cliente de cada camada e recebe de volta
+        (send) o texto da resposta, ou a exceção que a chamada levantou. Registra
+        as estatísticas e termina devolvendo o texto escolhido. Se nenhuma
+        resposta passar na validação, devolve a última reprovada apenas com
+        RespostaAproveitavel; sem ela, levanta o último erro.
+        """
+        ultimo_erro = None
+        candidato = None
+
+        for camada, modelo in enumerate(modelos):
+            inicio = time.perf_counter()
+            resposta = yield self._cliente(modelo)
+            latencia = time.perf_counter() - inicio
+
+            if isinstance(resposta, Exception):
+                self._registrar(tipo, modelo, latencia, erro=True)
+                ultimo_erro = resposta
+                continue
+
+            try:
+                if validar:
+                    validar(resposta)
+            except Exception as e:
+                self._registrar(tipo, modelo, latencia, reprovada=True)
+                ultimo_erro = e
+                if isinstance(e, RespostaAproveitavel):
+                    candidato = resposta
+                continue
+
+            self._registrar(tipo, modelo, latencia)
+            candidato = resposta
+            break
+
+        with self._lock:
+            st = self._stats_tipo(tipo)
+            st["pedidos"] += 1
+            if camada > 0:
+                st["escalonados"] += 1
+
+        if candidato is None:
+            raise ultimo_erro
+        return candidato
+
+    def _modelos(self, modelos):
+        modelos = self.modelos if modelos is None else list(modelos)
+        if not modelos:
+            raise Exception("ModelRouter precisa de pelo menos um modelo.")
+        return modelos
+
+    def invoke(self, prompt, variaveis, validar=None, tipo="geral", modelos=None):
+        """
+        Formata o prompt e devolve o texto da primeira resposta válida.
+        `validar(texto)` deve levantar exceção quando a resposta não serve.
+        `tipo` separa as estatísticas; `modelos` substitui as camadas padrão.
+        """
+        mensagens = prompt.format_messages(**variaveis)
+        passos = self._escalonar(validar, tipo, self._modelos(modelos))
+        cliente = next(passos)
+        while True:
+            try:
+                resposta = cliente.invoke(mensagens).content.strip()
+            except Exception as e:
+                resposta = e
+            try:
+                cliente = passos.send(resposta)
+            except StopIteration as fim:
+                return fim.value
+
+    async def ainvoke(self, prompt, variaveis, validar=None, tipo="geral", modelos=None):
+        """
+        Versão assíncrona de invoke (usa `ainvoke` do cliente), para não
+        ocupar uma thread enquanto espera a resposta do modelo.
+        """
+        mensagens = prompt.format_messages(**variaveis)
+        passos = self._escalonar(validar, tipo, self._modelos(modelos))
+        cliente = next(passos)
+        while True:
+            try:
+                resposta = (await cliente.ainvoke(mensagens)).content.strip()
+            except Exception as e:
+                resposta = e
+            try:
+                cliente = passos.send(resposta)
+            except StopIteration as fim:
+                return fim.value
+
+    def estatisticas(self):
+        """
+        Retorna, por tipo de chamada, {"pedidos", "escalonados",
+        "taxa_escalonamento", "modelos": {...}} com latência média/máxima (s)
+        e contagem de reprovações por modelo.
+        """
+        with self._lock:
+            resultado = {}
+            for tipo, st_tipo in self._stats.items():
+                modelos = {}
+                for modelo, st in st_tipo["modelos"].items():
+                    modelos[modelo] = {
+                        "chamadas": st["chamadas"],
+                        "reprovadas": st["reprovadas"],
+                        "erros": st["erros"],
+                        "latencia_media": st["latencia_total"] / st["chamadas"] if st["chamadas"] else 0.0,
+                        "latencia_max": st["latencia_max"],
+                    }
+                pedidos = st_tipo["pedidos"]
+                resultado[tipo] = {
+                    "pedidos": pedidos,
+                    "escalonados": st_tipo["escalonados"],
+                    "taxa_escalonamento": st_tipo["escalonados"] / pedidos if pedidos else 0.0,
+                    "modelos": modelos,
+                }
+            return resultado
+
+
+# Instância global compartilhada por todas as sessões
+model_router = ModelRouter([MODELO_RAPIDO, MODELO_FORTE])
+
 
 # =============================================================================
 # FUNÇÕES AUXILIARES DE EXTRAÇÃO (LangChain)
 # =============================================================================
-def fetch_webpage(url):
+# Cliente HTTP assíncrono compartilhado (reaproveita conexões entre pedidos)
+_http_client = None
+
+
+def _get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=LIMITES_CONCORRENCIA["extracao"]),
+        )
+    return _http_client
+
+
+async def fetch_webpage(url):
     try:
-        response = requests.get(url)
+        response = await _get_http_client().get(url)
         response.raise_for_status()
         if not response.text.strip():
             raise Exception("A URL não retornou nenhum conteúdo HTML.")
         return response.text
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise Exception(f"Erro ao acessar a página: {e}")
 
-def process_html_with_langchain(html_content):
-    prompt = ChatPromptTemplate.from_template("""
-        Você é um modelo que analisa notas fiscais. Extraia as seguintes informações gerais da nota:
-        - CNPJ do Emitente
-        - Número
-        - Série
-        - Emissão (data)
-        - Horário
-
-        Além disso, extraia os produtos listados e organize-os no seguinte formato:
-        {{
-            "Dados Nota": {{
-                "CNPJ": "CNPJ do Emitente",
-                "Número": "Número da Nota",
-                "Série": "Série da Nota",
-                "Emissão": "Data de Emissão",
-                "Horário": "Horário de Emissão"
-            }},
-            "Produtos": [
-                {{
-                    "Id": "Número identificador",
-                    "Text": "Nome do Produto",
-                    "Category": "Categoria do Produto",
-                    "Traits": {{
-                        "Quantidade": "Quantidade do Produto",
-                        "Unidade": "Unidade de Medida",
-                        "Valor Unitário": "Valor Unitário do Produto",
-                        "Valor Total": "Valor Total do Produto"
-                    }}
+
+EXTRACAO_PROMPT = ChatPromptTemplate.from_template("""
+    Você é um modelo que analisa notas fiscais. Extraia as seguintes informações gerais da nota:
+    - CNPJ do Emitente
+    - Número
+    - Série
+    - Emissão (data)
+    - Horário
+    - Valor Total da nota
+
+    Além disso, extraia os produtos listados e organize-os no seguinte formato:
+    {{
+        "Dados Nota": {{
+            "CNPJ": "CNPJ do Emitente",
+            "Número": "Número da Nota",
+            "Série": "Série da Nota",
+            "Emissão": "Data de Emissão",
+            "Horário": "Horário de Emissão",
+            "Valor Total": "Valor Total da Nota"
+        }},
+        "Produtos": [
+            {{
+                "Id": "Número identificador",
+                "Text": "Nome do Produto",
+                "Category": "Categoria do Produto",
+                "Traits": {{
+                    "Quantidade": "Quantidade do Produto",
+                    "Unidade": "Unidade de Medida",
+                    "Valor Unitário": "Valor Unitário do Produto",
+                    "Valor Total": "Valor Total do Produto"
                 }}
-            ]
-        }}
-        Certifique-se de que o JSON esteja bem formatado e sem erros.
-
-        HTML da Nota Fiscal:
-        {html_content}
-    """)
-    llm = ChatOpenAI(model="gpt-4", temperature=0)
-    runnable = RunnableMap({"entities": prompt | llm})
+            }}
+        ]
+    }}
+    Certifique-se de que o JSON esteja bem formatado e sem erros.
+
+    HTML da Nota Fiscal:
+    {html_content}
+""")
+
+
+def parse_valor(texto):
+    """
+    Converte valores como '12,50', '1.234,56', 'R$ 3.99' ou 7 para float.
+    """
+    if isinstance(texto, (int, float)):
+        return float(texto)
+    texto = str(texto).replace("R$", "").strip()
+    if "," in texto:
+        texto = texto.replace(".", "").replace(",", ".")
+    return float(texto)
+
+
+class TotalNotaDivergente(RespostaAproveitavel):
+    """
+    A extração tem o formato esperado, mas a soma dos itens não confere com
+    o total da nota (ou o total não foi extraído).
+    """
+
+
+def validar_extracao(resultado):
+    """
+    Confere se o JSON extraído tem o formato esperado e se a soma dos
+    valores dos produtos bate com o valor total da nota.
+    Levanta TotalNotaDivergente quando só a conferência do total falha e
+    Exception para qualquer outro problema (a resposta não pode ser salva).
+    """
     try:
-        result = runnable.invoke({"html_content": html_content})
-        return result["entities"].content.strip()
+        dados = json.loads(resultado)
+    except json.JSONDecodeError as e:
+        raise Exception(f"JSON inválido: {e}")
+    if not isinstance(dados, dict):
+        raise Exception("JSON da extração não é um objeto.")
+
+    dados_nota = dados.get("Dados Nota")
+    produtos = dados.get("Produtos")
+    if not isinstance(dados_nota, dict) or not isinstance(produtos, list) or not produtos:
+        raise Exception("Campos 'Dados Nota' e 'Produtos' ausentes ou vazios.")
+    for campo in ("CNPJ", "Emissão"):
+        if not dados_nota.get(campo):
+            raise Exception(f"Campo '{campo}' ausente em 'Dados Nota'.")
+
+    try:
+        soma = sum(parse_valor(p.get("Traits", {}).get("Valor Total")) for p in produtos)
+    except (AttributeError, TypeError, ValueError):
+        raise Exception("Valores dos produtos em formato inválido.")
+    try:
+        total = parse_valor(dados_nota.get("Valor Total"))
+    except (TypeError, ValueError):
+        raise TotalNotaDivergente("Valor total da nota ausente ou em formato inválido.")
+    if abs(soma - total) > TOLERANCIA_TOTAL_NOTA:
+        raise TotalNotaDivergente(
+            f"Soma dos itens (R$ {soma:.2f}) difere do total da nota (R$ {total:.2f})."
+        )
+
+
+async def process_html_with_langchain(html_content):
+    try:
+        return await model_router.ainvoke(
+            EXTRACAO_PROMPT, {"html_content": html_content},
+            validar=validar_extracao, tipo="extracao"
+        )
     except Exception as e:
         raise Exception(f"Erro ao processar o HTML com o modelo: {e}")
 
@@ -362,6 +793,180 @@ def filtrar_dados(resultado):
         raise Exception("Erro ao decodificar JSON", e)
 
 
+# =============================================================================
+# FUNÇÕES DE EXPORTAÇÃO (CSV / NDJSON / PARQUET)
+# =============================================================================
+FORMATOS_DATA = ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y")
+
+
+def parse_data(texto):
+    """
+    Converte uma data em texto (ex: '25/01/2025' ou '2025-01-25') para date.
+    Ignora horário no final (ex: '25/01/2025 14:30:00').
+    Retorna None se o texto estiver vazio ou em formato desconhecido.
+    """
+    if not texto:
+        return None
+    texto = str(texto).strip().split(" ")[0]
+    for fmt in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def normalizar_cnpj(cnpj):
+    """
+    Mantém apenas os dígitos do CNPJ (ex: '12.345.678/0001-90' -> '12345678000190').
+    """
+    if not cnpj:
+        return None
+    digitos = "".join(ch for ch in str(cnpj) if ch.isdigit())
+    return digitos or None
+
+
+def _data_do_filtro(valor, rotulo):
+    """
+    Aceita date, texto de data ou vazio (sem filtro).
+    """
+    if not valor:
+        return None
+    if not isinstance(valor, str):
+        return valor
+    if not valor.strip():
+        return None
+    data = parse_data(valor)
+    if data is None:
+        raise Exception(f"Data {rotulo} inválida: {valor}")
+    return data
+
+
+def _filtrar_por_data(blocos, idx_emissao, data_inicio, data_fim):
+    """
+    Aplica o filtro de período sobre cada bloco, sem juntar os blocos.
+    Linhas com emissão em formato desconhecido ficam de fora quando
+    há filtro de data.
+    """
+    for rows in blocos:
+        if data_inicio or data_fim:
+            filtradas = []
+            for row in rows:
+                data = parse_data(row[idx_emissao])
+                if data is None:
+                    continue
+                if data_inicio and data < data_inicio:
+                    continue
+                if data_fim and data > data_fim:
+                    continue
+                filtradas.append(row)
+            rows = filtradas
+        if rows:
+            yield rows
+
+
+def _escrever_csv(caminho, colunas, blocos):
+    total = 0
+    with open(caminho, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(colunas)
+        for rows in blocos:
+            writer.writerows(rows)
+            total += len(rows)
+    return total
+
+
+def _escrever_ndjson(caminho, colunas, blocos):
+    total = 0
+    with open(caminho, "w", encoding="utf-8") as f:
+        for rows in blocos:
+            for row in rows:
+                f.write(json.dumps(dict(zip(colunas, row)), ensure_ascii=False))
+                f.write("\n")
+            total += len(rows)
+    return total
+
+
+def _escrever_parquet(caminho, colunas, blocos):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("Exportação em Parquet requer o pacote 'pyarrow' (pip install pyarrow).")
+
+    # Colunas de id são inteiras; o restante é armazenado como TEXT no BD
+    schema = pa.schema([
+        (col, pa.int64() if col in ("id", "nota_id") else pa.string())
+        for col in colunas
+    ])
+    total = 0
+    buffer = []
+    linhas_buffer = 0
+    with pq.ParquetWriter(caminho, schema) as writer:
+        for rows in blocos:
+            arrays = [
+                pa.array([row[i] for row in rows], type=schema.field(i).type)
+                for i in range(len(colunas))
+            ]
+            buffer.append(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            linhas_buffer += len(rows)
+            total += len(rows)
+            while linhas_buffer >= PARQUET_ROW_GROUP_SIZE:
+                # Grava exatamente um row group; o que sobra fica para o próximo
+                tabela = pa.Table.from_batches(buffer, schema=schema)
+                writer.write_table(tabela.slice(0, PARQUET_ROW_GROUP_SIZE))
+                resto = tabela.slice(PARQUET_ROW_GROUP_SIZE)
+                buffer = resto.to_batches()
+                linhas_buffer = resto.num_rows
+        if buffer or total == 0:
+            writer.write_table(pa.Table.from_batches(buffer, schema=schema))
+    return total
+
+
+ESCRITORES_EXPORTACAO = {
+    "csv": _escrever_csv,
+    "ndjson": _escrever_ndjson,
+    "parquet": _escrever_parquet,
+}
+
+
+def exportar_dados(db, formato, destino_dir, data_inicio=None, data_fim=None,
+                   cnpj=None, prefixo="export", chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Exporta as tabelas de notas e produtos de um NotaFiscalDB para
+    '<prefixo>_notas.<formato>' e '<prefixo>_produtos.<formato>' em `destino_dir`.
+
+    As linhas são lidas e gravadas em blocos de `chunk_size`, então o uso de
+    memória não depende da quantidade de notas. `data_inicio`/`data_fim`
+    aceitam date ou texto ('dd/mm/aaaa' ou 'aaaa-mm-dd').
+
+    Retorna (lista de caminhos gerados, {tabela: linhas exportadas}).
+    """
+    formato = (formato or "").lower()
+    if formato not in ESCRITORES_EXPORTACAO:
+        raise Exception(f"Formato inválido: {formato}. Use: {', '.join(FORMATOS_EXPORTACAO)}.")
+
+    inicio = _data_do_filtro(data_inicio, "inicial")
+    fim = _data_do_filtro(data_fim, "final")
+    cnpj = normalizar_cnpj(cnpj)
+
+    escrever = ESCRITORES_EXPORTACAO[formato]
+    os.makedirs(destino_dir, exist_ok=True)
+
+    tabelas = [
+        ("notas", COLUNAS_EXPORT_NOTAS, db.iter_notas(cnpj, chunk_size)),
+        ("produtos", COLUNAS_EXPORT_PRODUTOS, db.iter_produtos(cnpj, chunk_size)),
+    ]
+    arquivos = []
+    contagem = {}
+    for nome, colunas, blocos in tabelas:
+        caminho = os.path.join(destino_dir, f"{prefixo}_{nome}.{formato}")
+        blocos = _filtrar_por_data(blocos, colunas.index("emissao"), inicio, fim)
+        contagem[nome] = escrever(caminho, colunas, blocos)
+        arquivos.append(caminho)
+    return arquivos, contagem
+
+
 # =============================================================================
 # FUNÇÕES PARA A LÓGICA DO SISTEMA
 # =============================================================================
@@ -411,6 +1016,18 @@ def excluir_conta(state):
 # =============================================================================
 # FUNÇÕES RELACIONADAS AO BD DE CADA USUÁRIO
 # =============================================================================
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="sqlite")
+
+
+async def run_db(func, *args):
+    """
+    Executa uma função bloqueante (acesso ao SQLite) no executor do BD,
+    liberando o event loop enquanto ela roda.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, func, *args)
+
+
 def get_user_db(state):
     """
     Devolve uma instância NotaFiscalDB com base no username logado.
@@ -420,22 +1037,21 @@ def get_user_db(state):
     return NotaFiscalDB(db_path)
 
 
-def adicionar_nota(url, state):
+async def adicionar_nota(url, state):
     if not state["logged_in"]:
         return "Você não está logado. Faça login para adicionar notas."
 
     try:
-        html_content = fetch_webpage(url)
-        resultado = process_html_with_langchain(html_content)
+        html_content = await fetch_webpage(url)
+        resultado = await process_html_with_langchain(html_content)
         dados_filtrados = filtrar_dados(resultado)
 
-        db = get_user_db(state)
-        db.salvar_dados(
+        await run_db(lambda: get_user_db(state).salvar_dados(
             dados_filtrados["CNPJ"],
             dados_filtrados["Emissao"],
             dados_filtrados["Dados Nota"],
             dados_filtrados["Produtos"]
-        )
+        ))
         return "Nota adicionada com sucesso!"
     except Exception as e:
         return f"Erro ao adicionar a nota: {e}"
@@ -493,23 +1109,32 @@ def calcular_financeiro_interface(notas_selecionadas, state):
     )
 
 
-def gerar_consultoria(state):
+CONSULTORIA_PROMPT = ChatPromptTemplate.from_template("""
+    Você é um consultor que avalia variações de preços em supermercados.
+    Receba a lista de produtos abaixo (com CNPJ do mercado + preço unitário)
+    e forneça:
+
+    1. Comparação de valores (onde está mais barato ou mais caro).
+    2. Observações sobre variações de preço.
+    3. Dicas de consumo.
+
+    Lista de produtos:
+    {resumo}
+
+    Escreva em português claro e objetivo.
+""")
+
+
+def validar_consultoria(resultado):
+    if not resultado:
+        raise Exception("Relatório de consultoria vazio.")
+
+
+async def gerar_consultoria(state):
     if not state["logged_in"]:
         return "Você não está logado."
 
-    db = get_user_db(state)
-    conn = db._connect()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT nome, cnpj_emissao, valor_unitario
-        FROM produtos
-        WHERE nome != ''
-          AND valor_unitario != ''
-        ORDER BY nome
-    """)
-    rows = cursor.fetchall()
-    conn.close()
+    rows = await run_db(lambda: get_user_db(state).listar_precos_produtos())
 
     if not rows:
         return "Nenhum produto encontrado para consultoria."
@@ -518,34 +1143,137 @@ def gerar_consultoria(state):
     for nome, cnpj, valor in rows:
         resumo += f"- Produto: {nome}; Mercado/Emissor: {cnpj}; Preço Unit.: {valor}\n"
 
-    consultoria_prompt = ChatPromptTemplate.from_template("""
-        Você é um consultor que avalia variações de preços em supermercados.
-        Receba a lista de produtos abaixo (com CNPJ do mercado + preço unitário)
-        e forneça:
+    try:
+        return await model_router.ainvoke(
+            CONSULTORIA_PROMPT, {"resumo": resumo},
+            validar=validar_consultoria, tipo="consultoria", modelos=[MODELO_FORTE]
+        )
+    except Exception as e:
+        return f"Erro ao gerar consultoria: {str(e)}"
+
+
+def estatisticas_modelos_interface():
+    estatisticas = model_router.estatisticas()
+    if not estatisticas:
+        return "Nenhuma chamada aos modelos ainda."
+    linhas = []
+    for tipo, st in estatisticas.items():
+        linhas.append(
+            f"[{tipo}] Pedidos: {st['pedidos']}, escalonados p/ modelo forte: "
+            f"{st['escalonados']} ({st['taxa_escalonamento']:.0%})"
+        )
+        for modelo, m in st["modelos"].items():
+            linhas.append(
+                f"  {modelo}: {m['chamadas']} chamadas, {m['reprovadas']} reprovadas, "
+                f"{m['erros']} erros, latência média {m['latencia_media']:.2f}s, "
+                f"máx {m['latencia_max']:.2f}s"
+            )
+        linhas.append("")
+    return "\n".join(linhas).strip()
+
+
+def limpar_exportacoes_antigas():
+    """
+    Remove as pastas de exportação criadas há mais de EXPORT_TTL segundos.
+    """
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    limite = time.time() - EXPORT_TTL
+    for nome in os.listdir(EXPORT_DIR):
+        caminho = os.path.join(EXPORT_DIR, nome)
+        try:
+            if os.path.getmtime(caminho) < limite:
+                shutil.rmtree(caminho, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def _limpeza_periodica_exportacoes():
+    while True:
+        limpar_exportacoes_antigas()
+        time.sleep(EXPORT_TTL)
+
+
+def exportar_interface(formato, data_inicio, data_fim, cnpj, state):
+    """
+    Gera os arquivos de exportação do usuário logado em uma pasta dentro de
+    EXPORT_DIR, apagada depois de EXPORT_TTL segundos (o Gradio precisa dos
+    arquivos após o retorno do handler para copiá-los para o seu cache).
+    Retorna (lista de arquivos para download, mensagem de status).
+    """
+    if not state["logged_in"]:
+        return None, "Você não está logado."
+
+    limpar_exportacoes_antigas()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    db = get_user_db(state)
+    destino = tempfile.mkdtemp(prefix="export_", dir=EXPORT_DIR)
+    try:
+        arquivos, contagem = exportar_dados(
+            db, formato, destino,
+            data_inicio=data_inicio, data_fim=data_fim, cnpj=cnpj,
+            prefixo=state["username"]
+        )
+    except Exception as e:
+        shutil.rmtree(destino, ignore_errors=True)
+        return None, f"Erro ao exportar: {e}"
+    return arquivos, (
+        f"Exportação concluída: {contagem['notas']} notas, "
+        f"{contagem['produtos']} produtos."
+    )
+
 
-        1. Comparação de valores (onde está mais barato ou mais caro).
-        2. Observações sobre variações de preço.
-        3. Dicas de consumo.
+def _inteiro_positivo(texto):
+    valor = int(texto)
+    if valor < 1:
+        raise argparse.ArgumentTypeError(f"deve ser maior ou igual a 1: {texto}")
+    return valor
 
-        Lista de produtos:
-        {resumo}
 
-        Escreva em português claro e objetivo.
-    """)
-    llm = ChatOpenAI(model="gpt-4", temperature=0)
-    runnable = RunnableMap({"analysis": consultoria_prompt | llm})
+def exportar_cli(argv=None):
+    """
+    Exportação pela linha de comando, ex:
+        python main.py exportar --usuario joao --formato csv --inicio 01/01/2025
+    """
+    parser = argparse.ArgumentParser(
+        prog="main.py exportar",
+        description="Exporta notas e produtos de um usuário para CSV, NDJSON ou Parquet."
+    )
+    parser.add_argument("--usuario", required=True, help="Nome do usuário dono do BD")
+    parser.add_argument("--formato", choices=FORMATOS_EXPORTACAO, default="csv")
+    parser.add_argument("--saida", default=".", help="Pasta de destino dos arquivos")
+    parser.add_argument("--inicio", help="Data inicial de emissão (dd/mm/aaaa ou aaaa-mm-dd)")
+    parser.add_argument("--fim", help="Data final de emissão (dd/mm/aaaa ou aaaa-mm-dd)")
+    parser.add_argument("--cnpj", help="CNPJ do emitente (com ou sem pontuação)")
+    parser.add_argument("--chunk-size", type=_inteiro_positivo, default=EXPORT_CHUNK_SIZE,
+                        help="Linhas lidas do BD por vez")
+    args = parser.parse_args(argv)
+
+    db_path = user_manager.get_user_db_path(args.usuario)
+    if not os.path.exists(db_path):
+        print(f"BD do usuário não encontrado: {db_path}", file=sys.stderr)
+        return 1
 
     try:
-        result = runnable.invoke({"resumo": resumo})
-        return result["analysis"].content.strip()
+        arquivos, contagem = exportar_dados(
+            NotaFiscalDB(db_path), args.formato, args.saida,
+            data_inicio=args.inicio, data_fim=args.fim, cnpj=args.cnpj,
+            prefixo=args.usuario, chunk_size=args.chunk_size
+        )
     except Exception as e:
-        return f"Erro ao gerar consultoria: {str(e)}"
+        print(f"Erro ao exportar: {e}", file=sys.stderr)
+        return 1
+
+    for caminho in arquivos:
+        print(caminho)
+    print(f"{contagem['notas']} notas, {contagem['produtos']} produtos exportados.")
+    return 0
 
 
 # =============================================================================
 # INTERFACE GRADIO
 # =============================================================================
-with gr.Blocks() as interface:
+with gr.Blocks(delete_cache=(EXPORT_TTL, EXPORT_TTL)) as interface:
     # Armazena se o usuário está logado, etc.
     state = gr.State({"logged_in": False, "username": ""})
 
@@ -568,15 +1296,17 @@ with gr.Blocks() as interface:
         registrar_btn = gr.Button("Registrar")
         registrar_out = gr.Textbox(label="Status do Registro", lines=2)
 
-        def acao_registrar(u, p, c, st):
-            msg = registrar_conta(u, p, c, st)
+        async def acao_registrar(u, p, c, st):
+            msg = await run_db(registrar_conta, u, p, c, st)
             lbl = label_usuario(st)
             return (msg, lbl, st)
 
         registrar_btn.click(
             fn=acao_registrar,
             inputs=[username_reg, password_reg, common_reg, state],
-            outputs=[registrar_out, usuario_label, state]
+            outputs=[registrar_out, usuario_label, state],
+            concurrency_id="conta",
+            concurrency_limit=LIMITES_CONCORRENCIA["conta"]
         )
 
     # -- ABA LOGIN --
@@ -586,15 +1316,17 @@ with gr.Blocks() as interface:
         login_btn = gr.Button("Login")
         login_out = gr.Textbox(label="Status do Login", lines=2)
 
-        def acao_login(u, p, st):
-            msg = login_conta(u, p, st)
+        async def acao_login(u, p, st):
+            msg = await run_db(login_conta, u, p, st)
             lbl = label_usuario(st)
             return (msg, lbl, st)
 
         login_btn.click(
             fn=acao_login,
             inputs=[username_login, password_login, state],
-            outputs=[login_out, usuario_label, state]
+            outputs=[login_out, usuario_label, state],
+            concurrency_id="conta",
+            concurrency_limit=LIMITES_CONCORRENCIA["conta"]
         )
 
     # -- ABA CONTA (LOGOUT / EXCLUIR) --
@@ -605,26 +1337,30 @@ with gr.Blocks() as interface:
         excluir_btn = gr.Button("Excluir Conta")
         excluir_out = gr.Textbox(label="Status Exclusão", lines=2)
 
-        def acao_logout(st):
-            msg = logout_conta(st)
+        async def acao_logout(st):
+            msg = await run_db(logout_conta, st)
             lbl = label_usuario(st)
             return (msg, lbl, st)
 
         logout_btn.click(
             fn=acao_logout,
             inputs=[state],
-            outputs=[logout_out, usuario_label, state]
+            outputs=[logout_out, usuario_label, state],
+            concurrency_id="conta",
+            concurrency_limit=LIMITES_CONCORRENCIA["conta"]
         )
 
-        def acao_excluir(st):
-            msg = excluir_conta(st)
+        async def acao_excluir(st):
+            msg = await run_db(excluir_conta, st)
             lbl = label_usuario(st)
             return (msg, lbl, st)
 
         excluir_btn.click(
             fn=acao_excluir,
             inputs=[state],
-            outputs=[excluir_out, usuario_label, state]
+            outputs=[excluir_out, usuario_label, state],
+            concurrency_id="conta",
+            concurrency_limit=LIMITES_CONCORRENCIA["conta"]
         )
 
     # -- ABA LISTAR NOTAS --
@@ -632,13 +1368,15 @@ with gr.Blocks() as interface:
         listar_btn = gr.Button("Listar Notas")
         notas_output = gr.Textbox(label="Notas Fiscais")
 
-        def acao_listar(st):
-            return listar_notas(st)
+        async def acao_listar(st):
+            return await run_db(listar_notas, st)
 
         listar_btn.click(
             fn=acao_listar,
             inputs=[state],
-            outputs=notas_output
+            outputs=notas_output,
+            concurrency_id="leitura",
+            concurrency_limit=LIMITES_CONCORRENCIA["leitura"]
         )
 
     # -- ABA ADICIONAR NOTA --
@@ -647,13 +1385,15 @@ with gr.Blocks() as interface:
         adicionar_btn = gr.Button("Adicionar Nota")
         adicionar_output = gr.Textbox(label="Status")
 
-        def acao_adicionar(url, st):
-            return adicionar_nota(url, st)
+        async def acao_adicionar(url, st):
+            return await adicionar_nota(url, st)
 
         adicionar_btn.click(
             fn=acao_adicionar,
             inputs=[url_input, state],
-            outputs=adicionar_output
+            outputs=adicionar_output,
+            concurrency_id="extracao",
+            concurrency_limit=LIMITES_CONCORRENCIA["extracao"]
         )
 
     # -- ABA BUSCAR NOTA POR ID --
@@ -662,13 +1402,15 @@ with gr.Blocks() as interface:
         buscar_id_btn = gr.Button("Buscar")
         nota_id_output = gr.Textbox(label="Detalhes da Nota Fiscal")
 
-        def acao_buscar(nid, st):
-            return buscar_detalhes_por_id(nid, st)
+        async def acao_buscar(nid, st):
+            return await run_db(buscar_detalhes_por_id, nid, st)
 
         buscar_id_btn.click(
             fn=acao_buscar,
             inputs=[nota_id_input, state],
-            outputs=nota_id_output
+            outputs=nota_id_output,
+            concurrency_id="leitura",
+            concurrency_limit=LIMITES_CONCORRENCIA["leitura"]
         )
 
     # -- ABA ÁREA FINANCEIRA --
@@ -677,13 +1419,15 @@ with gr.Blocks() as interface:
         calcular_btn = gr.Button("Calcular")
         financeiro_output = gr.Textbox(label="Resultados Financeiros")
 
-        def acao_financeiro(ids, st):
-            return calcular_financeiro_interface(ids, st)
+        async def acao_financeiro(ids, st):
+            return await run_db(calcular_financeiro_interface, ids, st)
 
         calcular_btn.click(
             fn=acao_financeiro,
             inputs=[notas_selecionadas, state],
-            outputs=financeiro_output
+            outputs=financeiro_output,
+            concurrency_id="leitura",
+            concurrency_limit=LIMITES_CONCORRENCIA["leitura"]
         )
 
     # -- ABA CONSULTORIA --
@@ -692,13 +1436,62 @@ with gr.Blocks() as interface:
         consultoria_btn = gr.Button("Gerar Consultoria")
         consultoria_output = gr.Textbox(label="Relatório de Consultoria", lines=15)
 
-        def acao_consulta(st):
-            return gerar_consultoria(st)
+        async def acao_consulta(st):
+            return await gerar_consultoria(st)
 
         consultoria_btn.click(
             fn=acao_consulta,
             inputs=[state],
-            outputs=consultoria_output
+            outputs=consultoria_output,
+            concurrency_id="consultoria",
+            concurrency_limit=LIMITES_CONCORRENCIA["consultoria"]
+        )
+
+    # -- ABA MODELOS (ESTATÍSTICAS DO ROTEAMENTO) --
+    with gr.Tab("Modelos"):
+        gr.Markdown(
+            f"### Extração: {MODELO_RAPIDO} → {MODELO_FORTE}; consultoria: {MODELO_FORTE}"
         )
+        estatisticas_btn = gr.Button("Atualizar Estatísticas")
+        estatisticas_output = gr.Textbox(label="Latência e Escalonamento", lines=6)
+
+        estatisticas_btn.click(
+            fn=estatisticas_modelos_interface,
+            inputs=[],
+            outputs=estatisticas_output,
+            concurrency_id="leitura",
+            concurrency_limit=LIMITES_CONCORRENCIA["leitura"]
+        )
+
+    # -- ABA EXPORTAR --
+    with gr.Tab("Exportar"):
+        gr.Markdown("### Exportar notas e produtos")
+        formato_export = gr.Radio(
+            choices=list(FORMATOS_EXPORTACAO), value="csv", label="Formato"
+        )
+        inicio_export = gr.Textbox(label="Data inicial (dd/mm/aaaa) - opcional")
+        fim_export = gr.Textbox(label="Data final (dd/mm/aaaa) - opcional")
+        cnpj_export = gr.Textbox(label="CNPJ do emitente - opcional")
+        exportar_btn = gr.Button("Exportar")
+        exportar_arquivos = gr.File(label="Arquivos", file_count="multiple")
+        exportar_out = gr.Textbox(label="Status da Exportação", lines=1)
+
+        async def acao_exportar(fmt, ini, fim, cnpj, st):
+            return await run_db(exportar_interface, fmt, ini, fim, cnpj, st)
+
+        exportar_btn.click(
+            fn=acao_exportar,
+            inputs=[formato_export, inicio_export, fim_export, cnpj_export, state],
+            outputs=[exportar_arquivos, exportar_out],
+            concurrency_id="exportacao",
+            concurrency_limit=LIMITES_CONCORRENCIA["exportacao"]
+        )
+
+# Eventos sem concurrency_id próprio usam o limite das leituras
+interface.queue(default_concurrency_limit=LIMITES_CONCORRENCIA["leitura"])
 
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "exportar":
+        sys.exit(exportar_cli(sys.argv[2:]))
+    threading.Thread(target=_limpeza_periodica_exportacoes, daemon=True).start()
     interface.launch()